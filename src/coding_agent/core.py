@@ -1,7 +1,12 @@
+import asyncio
+import hashlib
+import json
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, cast
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, cast
 
 import anthropic
+import httpx
 from pydantic_settings import BaseSettings
 
 from coding_agent.tools import ALL_TOOLS, TOOL_MAP
@@ -13,6 +18,10 @@ class Settings(BaseSettings):
     debug: bool = False
     anthropic_api_key: str
     model: str
+    # Model used to summarize older turns; falls back to `model` if unset.
+    summary_model: Optional[str] = None
+    # Number of most recent messages kept verbatim when the history is compacted.
+    history_window: int = 40
 
     class Config:
         env_file = BASE_DIR / ".env"
@@ -20,7 +29,54 @@ class Settings(BaseSettings):
 
 settings = Settings()
 
-client = anthropic.Client(api_key=settings.anthropic_api_key)
+
+class LoopDetector:
+    """Detects a model calling the same tool with the same input over and over.
+
+    Keeps fingerprints of the most recent tool calls in a sliding window and
+    flags a call once an identical one was already made `max_repeats` times
+    within that window. The window is cleared whenever a file is modified,
+    since repeating a call after an edit is expected to give a new result.
+    """
+
+    def __init__(self, window: int = 5, max_repeats: int = 2) -> None:
+        self.window = window
+        self.max_repeats = max_repeats
+        self.calls: List[str] = []
+
+    def record(self, name: str, args: Dict[str, Any]) -> bool:
+        """Records a tool call.
+
+        Args:
+            name: The name of the called tool.
+            args: The input the tool was called with.
+
+        Returns:
+            bool: True if the call repeats too often and should not be executed.
+        """
+        key = hashlib.md5(
+            f"{name}:{json.dumps(args, sort_keys=True)}".encode(),
+            usedforsecurity=False,
+        ).hexdigest()
+        repeated = self.calls.count(key) >= self.max_repeats
+        self.calls.append(key)
+        del self.calls[: -self.window]
+        return repeated
+
+    def reset(self) -> None:
+        """Forgets all recorded calls, e.g. after a tool modified a file."""
+        self.calls.clear()
+
+
+# A single HTTP/2 connection pool is shared by all requests, so concurrent
+# requests are multiplexed over warm connections instead of opening new ones.
+client = anthropic.AsyncAnthropic(
+    api_key=settings.anthropic_api_key,
+    http_client=anthropic.DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+    ),
+)
 
 # Type alias for message parameters used in conversation history.
 # Represents the structure: {'role': 'user'|'assistant', 'content': List[Dict[str, str]]}
@@ -30,10 +86,34 @@ MessageParam = Dict[str, Any]
 # Type alias for tool parameter definitions passed to the Anthropic API.
 # Represents tool schema with structure: {'name': str, 'description': str, 'input_schema': Dict}.
 # Compatible with anthropic.types.ToolUnionParam for Claude function calling.
-ToolParam = Dict[str, Any]
+ToolParam = Mapping[str, Any]
+
+# Seconds without any streamed data after which a response is considered stalled.
+STREAM_TIMEOUT = 30.0
+# Number of times a stalled response is re-requested before giving up.
+STREAM_RETRIES = 2
+
+# Instruction used to condense older turns once the history outgrows its window.
+SUMMARY_PROMPT = (
+    "Summarize the conversation so far in a few paragraphs. Keep the user's "
+    "goals, decisions that were made, and the files that were read or changed, "
+    "so the conversation can be continued from the summary alone."
+)
+
+# Maximum number of tool rounds Claude may take to answer a single user prompt.
+MAX_ITERATIONS = 50
+
+# Maximum number of tokens of a single tool output that is sent back to Claude.
+MAX_OUTPUT_TOKENS = 8000
+# Upper bound of characters per token, used to cut huge outputs before counting.
+MAX_CHARS_PER_TOKEN = 10
+# Characters per token assumed when tokens cannot be counted.
+AVG_CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = "\n[... output truncated ...]"
 
 CONV: List[MessageParam] = []
-TOOLS: List[ToolParam] = [
+
+_tool_params: List[Dict[str, Any]] = [
     {
         "name": tool["name"],
         "description": tool["description"],
@@ -41,6 +121,16 @@ TOOLS: List[ToolParam] = [
     }
     for tool in ALL_TOOLS
 ]
+# Mark the end of the tool definitions as a prompt cache breakpoint, so the
+# (identical) tool schemas are served from the provider's cache on later turns.
+_tool_params[-1]["cache_control"] = {"type": "ephemeral"}
+
+# The tool definitions are read-only, since any change to them between requests
+# would invalidate the prompt cache. Nested values stay plain dicts and lists,
+# as the client serializes them as-is and mapping proxies are not JSON-encodable.
+TOOLS: Tuple[ToolParam, ...] = tuple(MappingProxyType(tool) for tool in _tool_params)
+# TOOLS typed as expected by the Anthropic client.
+TOOL_PARAMS = cast(Iterable[anthropic.types.ToolUnionParam], TOOLS)
 
 
 def loop() -> None:
@@ -53,31 +143,93 @@ def loop() -> None:
         None
     """
     print(f"Chat with Claude ({settings.model}) — press CTRL-C to quit")
+    with asyncio.Runner() as runner:
+        while True:
+            try:
+                user_input = input("\033[93mYou\033[0m: ")
+            except (EOFError, KeyboardInterrupt):
+                print()
+                break
+
+            if not user_input:
+                continue
+
+            CONV.append(
+                {"role": "user", "content": [{"type": "text", "text": user_input}]}
+            )
+            message = runner.run(stream_message())
+            runner.run(handle(message))
+            runner.run(compact_history())
+
+
+async def stream_message() -> anthropic.types.Message:
+    """Sends the conversation to Claude and streams the reply to the console.
+
+    Text blocks are printed as they arrive. If no data is received for
+    STREAM_TIMEOUT seconds, the stalled stream is abandoned and the request is
+    retried up to STREAM_RETRIES times.
+
+    Returns:
+        anthropic.types.Message: The complete assistant message.
+
+    Raises:
+        anthropic.APITimeoutError: If the request times out on every attempt.
+        httpx.TimeoutException: If the stream stalls on every attempt.
+    """
+    messages = with_cache_breakpoint(CONV)
+    attempt = 0
     while True:
         try:
-            user_input = input("\033[93mYou\033[0m: ")
-        except (EOFError, KeyboardInterrupt):
-            print()
-            break
+            async with client.messages.stream(
+                model=settings.model,
+                max_tokens=1024,
+                messages=cast(List[anthropic.types.MessageParam], messages),
+                tools=TOOL_PARAMS,
+                timeout=STREAM_TIMEOUT,
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content_block_start":
+                        if event.content_block.type == "text":
+                            print("\033[93mClaude\033[0m: ", end="", flush=True)
+                    elif event.type == "text":
+                        print(event.text, end="", flush=True)
+                    elif event.type == "content_block_stop":
+                        if event.content_block.type == "text":
+                            print()
+                return await stream.get_final_message()
+        except (anthropic.APITimeoutError, httpx.TimeoutException) as e:
+            attempt += 1
+            if attempt > STREAM_RETRIES:
+                raise
+            print(f"\n\033[91mError\033[0m: {e} Retrying...")
+
+
+def with_cache_breakpoint(conv: List[MessageParam]) -> List[MessageParam]:
+    """Returns the conversation with a prompt cache breakpoint on its last block.
+
+    The breakpoint lets the provider reuse the cached prefix of the conversation
+    on the next turn. CONV itself is never modified: only the last message is
+    copied, so earlier entries stay byte-identical across requests.
 
-        if not user_input:
-            continue
+    Args:
+        conv: The conversation history, ending with a user message.
 
-        CONV.append({"role": "user", "content": [{"type": "text", "text": user_input}]})
-        message = client.messages.create(
-            model=settings.model,
-            max_tokens=1024,
-            messages=cast(List[anthropic.types.MessageParam], CONV),
-            tools=cast(Iterable[anthropic.types.ToolUnionParam], TOOLS),
-        )
-        handle(message)
+    Returns:
+        List[MessageParam]: A shallow copy of conv with the breakpoint applied.
+    """
+    *history, last = conv
+    *blocks, last_block = last["content"]
+    blocks.append({**last_block, "cache_control": {"type": "ephemeral"}})
+    return [*history, {**last, "content": blocks}]
 
 
-def handle(message: anthropic.types.Message) -> None:
+async def handle(message: anthropic.types.Message) -> None:
     """Processes Claude's response messages and handles tool calls.
 
-    Consumes a message, prints any assistant text to the console, resolves tool
-    calls, and continues until the assistant has no outstanding tool requests.
+    Consumes a message whose text has already been streamed to the console,
+    runs its tool calls (concurrently if none of them modifies the project),
+    and continues until the assistant has no outstanding tool requests. Gives
+    up after MAX_ITERATIONS tool rounds.
 
     Args:
         message: An Anthropic API Message object containing Claude's response.
@@ -87,38 +239,142 @@ def handle(message: anthropic.types.Message) -> None:
     """
 
     pending: List[anthropic.types.Message] = [message]
+    loop_detector = LoopDetector()
+    iterations = 0
 
     while pending:
         current = pending.pop(0)
-        CONV.append({"role": message.role, "content": current.content})
+        CONV.append({"role": current.role, "content": current.content})
 
         if settings.debug:
-            print(f"\033[91mDebug\033[0m: {message.to_dict()}")
-        for block in current.content:
-            if block.type == "text":
-                print(f"\033[93mClaude\033[0m: {block.text}")
-            elif block.type == "tool_use":
-                result_block = run_tool(block)
-                CONV.append({"role": "user", "content": [result_block]})
-                pending.append(
-                    client.messages.create(
-                        model=settings.model,
-                        max_tokens=1024,
-                        messages=cast(List[anthropic.types.MessageParam], CONV),
-                        tools=cast(Iterable[anthropic.types.ToolUnionParam], TOOLS),
-                    )
-                )
-
-
-def run_tool(block: Any) -> Dict[str, Any]:
+            print(f"\033[91mDebug\033[0m: {current.to_dict()}")
+
+        tool_blocks = [block for block in current.content if block.type == "tool_use"]
+        if not tool_blocks:
+            continue
+
+        iterations += 1
+        if iterations > MAX_ITERATIONS:
+            # Answer the outstanding tool calls so the conversation stays valid.
+            result_blocks = [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": block.id,
+                    "is_error": True,
+                    "content": "Maximum number of tool iterations reached",
+                }
+                for block in tool_blocks
+            ]
+            CONV.append({"role": "user", "content": result_blocks})
+            print(f"\033[91mError\033[0m: Stopped after {MAX_ITERATIONS} tool rounds")
+            break
+
+        # Read-only tools run concurrently. A batch that modifies the project runs
+        # in the requested order, so reads see the edits requested before them.
+        if all(is_read_only(block) for block in tool_blocks):
+            result_blocks = await asyncio.gather(
+                *(run_tool(block, loop_detector) for block in tool_blocks)
+            )
+        else:
+            result_blocks = [
+                await run_tool(block, loop_detector) for block in tool_blocks
+            ]
+
+        # All results of one assistant turn go back in a single user message.
+        CONV.append({"role": "user", "content": list(result_blocks)})
+        pending.append(await stream_message())
+
+
+async def compact_history() -> None:
+    """Replaces the older part of the conversation with a summary.
+
+    Once CONV holds more than twice `settings.history_window` messages, every
+    exchange before the last `settings.history_window` messages is summarized
+    into a single user message. Compacting only at twice the window keeps the
+    summarized prefix stable for many turns, so prompt caching stays effective.
+    If no complete summary can be obtained, the conversation is left unchanged.
+
+    Returns:
+        None
+    """
+    window = settings.history_window
+    if len(CONV) <= 2 * window:
+        return
+
+    # Cut right before a user prompt, so that no tool_result is separated from
+    # the tool_use it answers.
+    boundary = next(
+        (
+            i
+            for i in range(len(CONV) - window, 0, -1)
+            if CONV[i]["role"] == "user" and CONV[i]["content"][0]["type"] == "text"
+        ),
+        None,
+    )
+    if boundary is None:
+        return
+
+    # Compaction is only an optimization: on any failure, CONV stays unchanged.
+    try:
+        summary = await client.messages.create(
+            model=settings.summary_model or settings.model,
+            max_tokens=1024,
+            messages=cast(
+                List[anthropic.types.MessageParam],
+                [
+                    *CONV[:boundary],
+                    {
+                        "role": "user",
+                        "content": [{"type": "text", "text": SUMMARY_PROMPT}],
+                    },
+                ],
+            ),
+            tools=TOOL_PARAMS,
+            tool_choice={"type": "none"},
+        )
+    except anthropic.APIError as e:
+        print(f"\033[91mError\033[0m: Could not summarize the conversation: {e}")
+        return
+
+    text = "".join(block.text for block in summary.content if block.type == "text")
+    if summary.stop_reason != "end_turn" or not text.strip():
+        return
+
+    CONV[:boundary] = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"Summary of prior conversation: {text}"}
+            ],
+        }
+    ]
+
+
+def is_read_only(block: Any) -> bool:
+    """Checks whether a tool_use block calls a tool that does not modify files.
+
+    Args:
+        block: A tool_use block from Claude's response.
+
+    Returns:
+        bool: True if the tool is known and read-only.
+    """
+    spec = TOOL_MAP.get(getattr(block, "name", ""))
+    return spec is not None and spec["read_only"]
+
+
+async def run_tool(block: Any, loop_detector: LoopDetector) -> Dict[str, Any]:
     """Executes a tool based on Claude's tool_use request.
 
     Takes a tool_use block from Claude's response, attempts to execute the
-    specified tool with the provided parameters, and returns a result block
-    that can be sent back to Claude.
+    specified tool with the provided parameters in a worker thread, and returns
+    a result block that can be sent back to Claude.
 
     Args:
         block: A tool_use block from Claude's response containing tool name and input.
+        loop_detector: Tracks the tool calls of the current user prompt. Calls it
+            flags as repeated are not executed; it is reset after a successful
+            call to a tool that modifies files.
 
     Returns:
         Dict[str, Any]: A tool_result block containing the execution result or error.
@@ -135,15 +391,26 @@ def run_tool(block: Any) -> Dict[str, Any]:
             "content": f"Unknown tool '{name}'",
         }
         print(f"\033[91mTool error\033[0m: Unknown tool {name}")
+    elif loop_detector.record(name, payload):
+        result_block = {
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "is_error": True,
+            "content": "Loop detected: this tool was already called with the "
+            "same input. Try a different approach.",
+        }
+        print(f"\033[91mTool error\033[0m: Loop detected for {name}({payload})")
     else:
         try:
             print(f"\033[92mTool\033[0m: {name}({payload})")
-            output = spec["fn"](payload)
+            output = await asyncio.to_thread(spec["fn"], payload)
             result_block = {
                 "type": "tool_result",
                 "tool_use_id": block.id,
-                "content": output,
+                "content": await truncate_output(output),
             }
+            if not spec["read_only"]:
+                loop_detector.reset()
         except Exception as e:
             result_block = {
                 "type": "tool_result",
@@ -154,3 +421,35 @@ def run_tool(block: Any) -> Dict[str, Any]:
             print(f"\033[91mTool error\033[0m: {e}")
 
     return result_block
+
+
+async def truncate_output(output: str) -> str:
+    """Truncates a tool output to roughly MAX_OUTPUT_TOKENS tokens.
+
+    Outputs of at most MAX_OUTPUT_TOKENS characters are returned unchanged
+    without a network round trip, since even dense text (CJK, minified JSON,
+    base64) takes about one token per character at most. Longer outputs are
+    counted once with the token counting API and cut proportionally.
+
+    Args:
+        output: The tool output.
+
+    Returns:
+        str: The output, truncated and marked as such if it was too long.
+    """
+    if len(output) <= MAX_OUTPUT_TOKENS:
+        return output
+
+    head = output[: MAX_OUTPUT_TOKENS * MAX_CHARS_PER_TOKEN]
+    try:
+        count = await client.messages.count_tokens(
+            model=settings.model,
+            messages=[{"role": "user", "content": head}],
+        )
+        keep = len(head) * MAX_OUTPUT_TOKENS // max(count.input_tokens, 1)
+    except anthropic.APIError:
+        keep = MAX_OUTPUT_TOKENS * AVG_CHARS_PER_TOKEN
+
+    if keep >= len(output):
+        return output
+    return output[:keep] + TRUNCATION_MARKER
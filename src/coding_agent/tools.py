@@ -1,11 +1,24 @@
+import codecs
+import functools
 import json
 import os
+import shutil
+import stat
 import subprocess
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
+import orjson
 import pathspec
 
+# Maximum number of bytes read_file reads from a single file.
+MAX_READ_BYTES = 1024 * 1024
+# Number of threads list_files uses to scan directories.
+WALK_WORKERS = 8
+
 
 def schema(props: Dict[str, Any], required: List[str]) -> Dict[str, Any]:
     """Creates a JSON schema object for tool input validation.
@@ -25,44 +38,181 @@ def schema(props: Dict[str, Any], required: List[str]) -> Dict[str, Any]:
     }
 
 
-def _get_gitignore(root: Path) -> pathspec.PathSpec:
+@functools.cache
+def _global_ignore_path() -> Optional[Path]:
+    """Locates the global gitignore file.
+
+    A core.excludesFile set in the git config takes precedence. Only if it is
+    unset, or git is not installed, git's default location
+    ($XDG_CONFIG_HOME/git/ignore) is used if it exists. The result is cached
+    for the lifetime of the process.
+
+    Returns:
+        Optional[Path]: The path to the global gitignore file, or None if no
+            global excludes file is found.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "config", "--get", "core.excludesFile"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        if result.stdout.strip():
+            return Path(result.stdout.strip()).expanduser()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        pass
+
+    config_home = os.environ.get("XDG_CONFIG_HOME") or "~/.config"
+    default = (Path(config_home) / "git" / "ignore").expanduser()
+    return default if default.is_file() else None
+
+
+def _mtime_ns(path: Optional[Union[str, Path]]) -> Optional[int]:
+    """Returns the modification time of a file, or None if it is not a file.
+
+    Args:
+        path: The path to stat.
+
+    Returns:
+        Optional[int]: The modification time in nanoseconds, or None.
+    """
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns if stat.S_ISREG(st.st_mode) else None
+
+
+LOCAL_IGNORE_FILES = (".gitignore", ".git/info/exclude")
+
+
+class _Gitignore:
+    """Compiled gitignore patterns, prepared for a walk that prunes directories.
+
+    Since ignored directories are never entered, directory-only patterns (e.g.
+    `build/`) can never match a file that is still visited. Without negation
+    patterns, files are therefore only matched against the remaining patterns,
+    and not at all if there are none. Directory verdicts are memoized, so
+    repeated walks of the same tree match each directory only once.
+    """
+
+    def __init__(self, patterns: List[str]) -> None:
+        self.dir_spec = pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+        if any(pattern.startswith("!") for pattern in patterns):
+            self.file_spec: Optional[pathspec.PathSpec] = self.dir_spec
+        else:
+            file_patterns = [p for p in patterns if not p.rstrip().endswith("/")]
+            self.file_spec = pathspec.PathSpec.from_lines("gitwildmatch", file_patterns)
+            if not self.file_spec.patterns:
+                self.file_spec = None
+        self._dir_verdicts: Dict[str, bool] = {}
+
+    def match_dir(self, rel_dir: str) -> bool:
+        """Checks whether a directory is ignored.
+
+        Args:
+            rel_dir: The relative POSIX path of the directory, ending with '/'.
+
+        Returns:
+            bool: True if the directory is ignored.
+        """
+        verdict = self._dir_verdicts.get(rel_dir)
+        if verdict is None:
+            verdict = self._dir_verdicts[rel_dir] = self.dir_spec.match_file(rel_dir)
+        return verdict
+
+    def match_files(self, rel_paths: Iterable[str]) -> Set[str]:
+        """Returns the ignored files among files in non-ignored directories.
+
+        Args:
+            rel_paths: The relative POSIX paths of the files.
+
+        Returns:
+            Set[str]: The subset of rel_paths that is ignored.
+        """
+        if self.file_spec is None:
+            return set()
+        return set(self.file_spec.match_files(rel_paths))
+
+
+def _get_gitignore(root: str) -> _Gitignore:
+    """Returns the compiled gitignore patterns that apply to a directory.
+
+    Compiled patterns are cached per root directory and reused for as long as
+    none of the ignore files have been modified, created or removed.
+
+    Args:
+        root: The root directory path to search for gitignore files.
+
+    Returns:
+        _Gitignore: The compiled patterns of all ignore files.
+    """
+    local_mtimes = tuple(
+        _mtime_ns(os.path.join(root, filename)) for filename in LOCAL_IGNORE_FILES
+    )
+    global_mtime = _mtime_ns(_global_ignore_path())
+
+    return _compile_gitignore(root, local_mtimes, global_mtime)
+
+
+def _read_patterns(path: Union[str, Path]) -> List[str]:
+    """Reads the patterns of an ignore file, skipping blank lines and comments.
+
+    Args:
+        path: The path of the ignore file.
+
+    Returns:
+        List[str]: The patterns in the order they appear in the file.
+    """
+    with open(path) as f:
+        return [
+            line
+            for line in f.read().splitlines()
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_gitignore(
+    root: str,
+    local_mtimes: Tuple[Optional[int], ...],
+    global_mtime: Optional[int],
+) -> _Gitignore:
     """Collects and compiles gitignore patterns from multiple sources.
 
     Collects ignore patterns from .gitignore, .git/info/exclude, and the
-    global .gitignore file.
+    global .gitignore file. The modification times are only part of the
+    signature so that edits to any ignore file invalidate the cache entry.
 
     Args:
         root: The root directory path to search for gitignore files.
+        local_mtimes: Modification times of the repository-specific ignore files.
+        global_mtime: Modification time of the global ignore file.
 
     Returns:
-        pathspec.PathSpec: A PathSpec object that can be used to match files against
-            all collected ignore patterns.
+        _Gitignore: The compiled patterns of all ignore files.
     """
 
     patterns: List[str] = []
 
     # Load repository-specific ignore files
-    local_ignore_files = [".gitignore", ".git/info/exclude"]
-    for filename in local_ignore_files:
-        path = root / filename
-        if path.is_file():
-            patterns.extend(path.read_text().splitlines())
+    for filename, mtime in zip(LOCAL_IGNORE_FILES, local_mtimes):
+        if mtime is not None:
+            patterns.extend(_read_patterns(os.path.join(root, filename)))
 
     # Load the global .gitignore file (if it exists)
-    try:
-        result = subprocess.run(
-            ["git", "config", "--get", "core.excludesFile"],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        global_ignore_path = Path(result.stdout.strip()).expanduser()
-        if global_ignore_path.is_file():
-            patterns.extend(global_ignore_path.read_text().splitlines())
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
+    global_ignore_path = _global_ignore_path()
+    if global_ignore_path is not None and global_mtime is not None:
+        patterns.extend(_read_patterns(global_ignore_path))
+
+    # Drop duplicate patterns. The last occurrence is kept, since later
+    # patterns take precedence over earlier ones.
+    patterns = list(dict.fromkeys(reversed(patterns)))[::-1]
 
-    return pathspec.PathSpec.from_lines("gitwildmatch", patterns)
+    return _Gitignore(patterns)
 
 
 def _resolve_relative(path_str: str) -> Path:
@@ -97,12 +247,95 @@ def _resolve_relative(path_str: str) -> Path:
     return abs_path
 
 
-def list_files(inp: Dict[str, str]) -> str:
+def _scan(
+    executor: ThreadPoolExecutor,
+    dir_path: str,
+    prefix_len: int,
+    ignore: Optional[_Gitignore],
+) -> List[Tuple[str, Optional[Future]]]:
+    """Scans a directory and schedules scans of its non-ignored subdirectories.
+
+    Entries are sorted by name. Ignored directories are pruned without being
+    entered, and symlinked directories are listed but not followed.
+
+    Args:
+        executor: The thread pool that runs the scans of subdirectories.
+        dir_path: The absolute path of the directory to scan.
+        prefix_len: Length of the base directory prefix to strip from entry paths.
+        ignore: The compiled ignore patterns, relative to the base directory, or
+            None to list all entries.
+
+    Returns:
+        List[Tuple[str, Optional[Future]]]: Relative POSIX paths of the entries
+            (directories end with '/'), each with the pending scan of its
+            subdirectory, or None.
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return []
+
+    results: List[Tuple[str, Optional[Future]]] = []
+    files: List[str] = []
+    for entry in entries:
+        rel_path = entry.path[prefix_len:].replace(os.sep, "/")
+
+        # Like os.walk, treat entries whose type cannot be determined (e.g.
+        # symlink loops) as files instead of failing the whole listing.
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+
+        if is_dir:
+            # The trailing slash makes directory-only patterns (e.g. `build/`)
+            # match. Ignored directories are pruned with their whole subtree.
+            rel_path += "/"
+            if ignore is not None and ignore.match_dir(rel_path):
+                continue
+            child = None
+            if not entry.is_symlink():
+                child = executor.submit(_scan, executor, entry.path, prefix_len, ignore)
+            results.append((rel_path, child))
+        else:
+            files.append(rel_path)
+            results.append((rel_path, None))
+
+    if ignore is None:
+        return results
+
+    # Match all files of this directory in a single call.
+    ignored = ignore.match_files(files)
+    if ignored:
+        results = [result for result in results if result[0] not in ignored]
+
+    return results
+
+
+def _collect(scan: Future) -> Iterator[str]:
+    """Yields the entries of a directory scan and its subdirectory scans.
+
+    Args:
+        scan: The pending scan of a directory.
+
+    Yields:
+        str: Relative POSIX paths in depth-first order; directories end with '/'.
+    """
+    for rel_path, child in scan.result():
+        yield rel_path
+        if child is not None:
+            yield from _collect(child)
+
+
+def list_files(inp: Dict[str, Any]) -> str:
     """Recursively lists files under a given path, respecting .gitignore rules.
 
     Args:
         inp: Dictionary containing input parameters.
             path: Optional base directory path. Defaults to current directory.
+            respect_gitignore: Optional flag. If False, ignore files are not
+                loaded and all entries are listed. Defaults to True.
 
     Returns:
         str: A JSON string containing an array of relative file paths.
@@ -111,47 +344,38 @@ def list_files(inp: Dict[str, str]) -> str:
         FileNotFoundError: If the specified path does not exist.
     """
 
-    base_dir_str = inp.get("path", ".")
-    base_dir = Path(base_dir_str).resolve()
+    # Plain strings are used throughout, as Path objects are comparatively
+    # expensive to create and the walk only needs relative POSIX strings.
+    base_dir = os.path.realpath(inp.get("path", "."))
 
-    if not base_dir.exists():
+    if not os.path.exists(base_dir):
         raise FileNotFoundError(f"'{base_dir}' does not exist")
 
-    if not base_dir.is_dir():
-        return json.dumps([])
-
-    ignore = _get_gitignore(base_dir)
-    results: List[str] = []
+    if not os.path.isdir(base_dir):
+        return "[]"
 
-    for root, dirs, files in os.walk(base_dir, topdown=True):
-        root_path = Path(root)
+    ignore = _get_gitignore(base_dir) if inp.get("respect_gitignore", True) else None
+    prefix_len = len(os.path.join(base_dir, ""))
 
-        # Remove ignored directories from the `dirs` list in-place.
-        for d in list(dirs):
-            rel_dir_path = (root_path / d).relative_to(base_dir).as_posix() + "/"
-            if ignore.match_file(rel_dir_path):
-                dirs.remove(d)
+    # Directories are scanned concurrently, since the walk mostly waits on
+    # readdir calls, which release the GIL.
+    with ThreadPoolExecutor(max_workers=WALK_WORKERS) as executor:
+        root = executor.submit(_scan, executor, base_dir, prefix_len, ignore)
+        results = list(_collect(root))
 
-        # Process all files and the remaining directories.
-        for name in files + dirs:
-            rel_path_str = (root_path / name).relative_to(base_dir).as_posix()
-
-            # Check if the individual file or directory is ignored.
-            if ignore.match_file(rel_path_str):
-                continue
-
-            # Add trailing slash for directories.
-            if (root_path / name).is_dir():
-                results.append(rel_path_str + "/")
-            else:
-                results.append(rel_path_str)
-
-    return json.dumps(sorted(results))
+    try:
+        return orjson.dumps(results).decode()
+    except orjson.JSONEncodeError:
+        # orjson rejects lone surrogates, which os.fsdecode produces for file
+        # names that are not valid UTF-8; the stdlib encoder escapes them.
+        return json.dumps(results, separators=(",", ":"))
 
 
 def read_file(inp: Dict[str, str]) -> str:
     """Returns the textual contents of a file.
 
+    Only the first MAX_READ_BYTES bytes of larger files are read.
+
     Args:
         inp: Dictionary containing input parameters.
             path: The relative path to the file to read.
@@ -171,33 +395,73 @@ def read_file(inp: Dict[str, str]) -> str:
     if path.is_dir():
         raise IsADirectoryError(f"Expected a file, found a directory: {inp['path']}")
 
+    with path.open("rb") as f:
+        data = f.read(MAX_READ_BYTES + 1)
+    truncated = len(data) > MAX_READ_BYTES
+
     try:
-        return path.read_text(encoding="utf-8")
+        # The incremental decoder tolerates a multi-byte sequence cut off at
+        # the read limit instead of failing on it.
+        text = codecs.getincrementaldecoder("utf-8")().decode(
+            data[:MAX_READ_BYTES], final=not truncated
+        )
     except UnicodeDecodeError:
-        return path.read_text(encoding="latin-1")
+        text = data[:MAX_READ_BYTES].decode("latin-1")
+
+    # Translate line endings the way text-mode reads do.
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    if truncated:
+        text += "\n[... file truncated ...]"
+    return text
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    """Replaces the contents of a file atomically.
+
+    Writes to a temporary file in the same directory and renames it over the
+    target, so the file is never left partially written.
+
+    Args:
+        path: The file to replace.
+        data: The new contents of the file.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        shutil.copymode(path, tmp_name)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
 
 
 def edit_file(inp: Dict[str, str]) -> str:
     """Edits the content of a file by replacing text or creating a new file.
 
     Replaces all occurrences of old_str with new_str in the specified file.
-    If the file does not exist and old_str is empty, creates a new file with
-    new_str as its content.
+    If old_str is empty and the file does not exist or is empty, writes new_str
+    as the file's content. Existing files are replaced atomically, and only
+    if old_str occurs in them.
 
     Args:
         inp: Dictionary containing input parameters.
             path: The relative path to the file to edit.
             old_str: The string to be replaced. If empty and file doesn't exist,
-                     a new file will be created.
+                     a new file will be created; if empty and the file is
+                     empty, new_str is written into it.
             new_str: The string to replace old_str with, or the content for a new file.
 
     Returns:
-        str: A success message indicating the file was edited or created.
+        str: A message indicating whether the file was edited or created.
 
     Raises:
         FileNotFoundError: If the file does not exist and old_str is not empty.
         IsADirectoryError: If the path points to a directory instead of a file.
-        ValueError: If the path is invalid.
+        ValueError: If the path is invalid, old_str is empty for a non-empty
+            file, or old_str does not occur in the file.
     """
     path = _resolve_relative(inp["path"])
     old_str = inp["old_str"]
@@ -219,17 +483,37 @@ def edit_file(inp: Dict[str, str]) -> str:
     if path.is_dir():
         raise IsADirectoryError(f"Expected a file, found a directory: {inp['path']}")
 
-    # Read the file content.
-    try:
-        content = path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        content = path.read_text(encoding="latin-1")
-
-    # Replace old_str with new_str.
-    new_content = content.replace(old_str, new_str)
-
-    # Write the modified content back to the file.
-    path.write_text(new_content, encoding="utf-8")
+    data = path.read_bytes()
+
+    # An empty old_str would match between every character, so it is only
+    # accepted to fill an empty file, e.g. a freshly created __init__.py.
+    if old_str == "":
+        if data:
+            raise ValueError(
+                "`old_str` must not be empty when editing a non-empty file"
+            )
+        _atomic_write(path, new_str.encode("utf-8"))
+        return f"Successfully edited file: {inp['path']}"
+
+    # Files with Windows line endings are shown with "\n" by read_file.
+    if b"\r\n" in data:
+        old_str = old_str.replace("\n", "\r\n")
+        new_str = new_str.replace("\n", "\r\n")
+
+    # ASCII text has the same bytes in UTF-8 and latin-1, so it can be replaced
+    # without decoding the file. Otherwise, match the file's own encoding.
+    encoding = "utf-8"
+    if not (old_str.isascii() and new_str.isascii()):
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+
+    old_bytes = old_str.encode(encoding)
+    if old_bytes not in data:
+        raise ValueError(f"`old_str` not found in file: {inp['path']}")
+
+    _atomic_write(path, data.replace(old_bytes, new_str.encode(encoding)))
 
     return f"Successfully edited file: {inp['path']}"
 
@@ -241,6 +525,7 @@ READ_FILE = {
         {"path": {"type": "string", "description": "Relative file path"}}, ["path"]
     ),
     "fn": read_file,
+    "read_only": True,
 }
 
 
@@ -249,12 +534,23 @@ LIST_FILES = {
     "description": (
         "Recursively list files/directories under a path. "
         "Returns JSON array of relative paths; directories end with '/'. "
-        "If no path is given, the current directory is used."
+        "If no path is given, the current directory is used. "
+        "Entries ignored by .gitignore are skipped unless respect_gitignore is "
+        "false, which is faster for small or known-clean subtrees."
     ),
     "input_schema": schema(
-        {"path": {"type": "string", "description": "Optional base dir"}}, []
+        {
+            "path": {"type": "string", "description": "Optional base dir"},
+            "respect_gitignore": {
+                "type": "boolean",
+                "description": "Skip entries ignored by .gitignore",
+                "default": True,
+            },
+        },
+        [],
     ),
     "fn": list_files,
+    "read_only": True,
 }
 
 
@@ -273,8 +569,9 @@ EDIT_FILE = {
         ["path", "old_str", "new_str"],
     ),
     "fn": edit_file,
+    "read_only": False,
 }
 
 
 ALL_TOOLS = [LIST_FILES, READ_FILE, EDIT_FILE]
-TOOL_MAP = {t["name"]: t for t in ALL_TOOLS}
+TOOL_MAP = MappingProxyType({t["name"]: t for t in ALL_TOOLS})